@@ -3,19 +3,32 @@ import argparse
 import logging
 import csv
 import os
+import signal
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Callable, NamedTuple, Optional
 from bleak import BleakScanner
 from bleak.backends.bluezdbus.advertisement_monitor import OrPattern
 from bleak.backends.bluezdbus.scanner import BlueZScannerArgs, BlueZDiscoveryFilters
 from bleak.assigned_numbers import AdvertisementDataType
-from prometheus_client import Gauge, start_http_server
+from prometheus_client import REGISTRY, Gauge, start_http_server
 
 # === CONFIG ===
 TARGET_NAME = "ThermoBeacon"
 SERVICE_UUID = b"\xf0\xff"  # little-endian 0xFFF0
 MANUFACTURER_ID = 0x0010
+LOCATIONS_CSV = Path(__file__).resolve().parent / "resources" / "locations.csv"
+
+# <u16 voltage> <i16 temp> <u16 humidity> <u32 uptime> following the 8B header
+_SENSOR_STRUCT = struct.Struct("<HhHI")
+_unpack_sensor = _SENSOR_STRUCT.unpack_from
+_SENSOR_PACKET_SIZE = 8 + _SENSOR_STRUCT.size
 
 # === Logging ===
 logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 # === Prometheus metric with address label ===
 temperature_gauge = Gauge(
@@ -36,91 +49,189 @@ location_gauge = Gauge(
     ["address", "location"],
 )
 
+# Setters of one address's labelled children: (temperature, humidity, voltage, uptime)
+SensorSetters = tuple[
+    Callable[[float], None],
+    Callable[[float], None],
+    Callable[[float], None],
+    Callable[[float], None],
+]
+
+
+def sensor_setters(address: str) -> SensorSetters:
+    """
+    Return the bound set() methods of the labelled sensor gauges for an address.
+    """
+    return (
+        temperature_gauge.labels(address=address).set,
+        humidity_gauge.labels(address=address).set,
+        voltage_gauge.labels(address=address).set,
+        uptime_gauge.labels(address=address).set,
+    )
+
+
+class _Hex:
+    """
+    Lazy hex rendering of bytes for log arguments.
+    """
+
+    __slots__ = ("data",)
 
-class SensorData:
-    def __init__(
-        self,
-        temperature: float,
-        humidity: float,
-        voltage: float,
-        uptime_seconds: int,
-    ):
-        self.temperature = temperature
-        self.humidity = humidity
-        self.voltage = voltage
-        self.uptime_seconds = uptime_seconds
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def __str__(self) -> str:
+        return self.data.hex()
+
+
+class SensorData(NamedTuple):
+    temperature: float
+    humidity: float
+    voltage: float
+    uptime_seconds: int
 
 
 # === Decoder ===
-def decode_packet(data: bytes) -> SensorData:
+def decode_packet(data: bytes) -> Optional[SensorData]:
     """
-    Decode raw bytes to sensor data.
+    Decode raw bytes to sensor data, or None if this is not a sensor packet.
+    Fields are unpacked in place from offset 8, so no intermediate slices are made.
     """
+    # 20B packets carry no sensor readings; shorter ones cannot be unpacked
+    if len(data) == 20 or len(data) < _SENSOR_PACKET_SIZE:
+        return None
+
+    # Any buffer works here; bytes or memoryview are read without copying
+    voltage_raw, temp_raw, hum_raw, uptime_seconds = _unpack_sensor(data, 8)
+
+    # Voltage is in mV, temperature and humidity in 1/16 units
+    return SensorData(
+        temp_raw / 16.0, hum_raw / 16.0, voltage_raw / 1000.0, uptime_seconds
+    )
 
-    voltage = int.from_bytes(data[8:10], "little") / 1000.0  # Convert mV to V
-    temperature = int.from_bytes(data[10:12], "little", signed=True) / 16.0
-    humidity = int.from_bytes(data[12:14], "little") / 16.0
-    uptime_seconds = int.from_bytes(data[14:18], "little")
 
-    return SensorData(temperature, humidity, voltage, uptime_seconds)
+# Advertised local name -> decoder; all targets share a single scanner
+Decoder = Callable[[bytes], Optional[SensorData]]
+TARGETS: dict[str, Decoder] = {TARGET_NAME: decode_packet}
 
 
 # === Scanner callback ===
-def detection_callback(device, advertisement_data):
-    device_name = advertisement_data.local_name or device.name or ""
-    if device_name != TARGET_NAME:
-        return
-
-    mfg_data = advertisement_data.manufacturer_data.get(MANUFACTURER_ID)
-    if mfg_data:
-        if len(mfg_data) == 20:
-            logging.info(
-                "ADV (%dB) [%s]: %s",
+def make_detection_callback(
+    targets: dict[str, Decoder],
+    mfg_id: int,
+    child_cache: dict[str, SensorSetters],
+):
+    """
+    Build the scanner callback with its configuration and gauge cache captured
+    in the closure, so the per-advert path does no global lookups.
+    """
+    get_decoder = targets.get
+    log = logger
+    info = logging.INFO
+    # Last payload seen per (address, length), to skip re-broadcasts of unchanged
+    # data. Beacons alternate 18B and 20B packets, so each type is tracked separately.
+    last_payload: dict[tuple[str, int], bytes] = {}
+
+    def detection_callback(device, advertisement_data):
+        # Reject on manufacturer ID first: it is a single dict lookup and drops
+        # most foreign adverts before the name is resolved
+        mfg_data = advertisement_data.manufacturer_data.get(mfg_id)
+        if not mfg_data:
+            return
+
+        decode = get_decoder(advertisement_data.local_name)
+        if decode is None:
+            return
+
+        key = (device.address, len(mfg_data))
+        if last_payload.get(key) == mfg_data:
+            return
+        last_payload[key] = mfg_data
+
+        sensor_data = decode(mfg_data)
+        if sensor_data is None:
+            # Not a sensor packet for this target, only log it
+            if log.isEnabledFor(info):
+                log.info(
+                    "ADV (%dB) [%s]: %s",
+                    len(mfg_data),
+                    device.address,
+                    _Hex(mfg_data),
+                )
+            return
+        temperature, humidity, voltage, uptime_seconds = sensor_data
+        # The hex dump is only rendered if a handler formats the record
+        if log.isEnabledFor(info):
+            log.info(
+                "ADV (%dB) [%s]: %s -> %.1f°C, %.1f%% RH, %.3fV, %ds uptime",
                 len(mfg_data),
                 device.address,
-                mfg_data.hex(),
+                _Hex(mfg_data),
+                temperature,
+                humidity,
+                voltage,
+                uptime_seconds,
             )
-            return
-        sensor_data = decode_packet(mfg_data)
-        logging.info(
-            "ADV (%dB) [%s]: %s -> %.1f°C, %.1f%% RH, %.3fV, %ds uptime",
-            len(mfg_data),
-            device.address,
-            mfg_data.hex(),
-            sensor_data.temperature,
-            sensor_data.humidity,
-            sensor_data.voltage,
-            sensor_data.uptime_seconds,
-        )
-        temperature_gauge.labels(address=device.address).set(sensor_data.temperature)
-        humidity_gauge.labels(address=device.address).set(sensor_data.humidity)
-        voltage_gauge.labels(address=device.address).set(sensor_data.voltage)
-        uptime_gauge.labels(address=device.address).set(sensor_data.uptime_seconds)
+        setters = child_cache.get(device.address)
+        if setters is None:
+            setters = child_cache[device.address] = sensor_setters(device.address)
+        set_temp, set_hum, set_volt, set_uptime = setters
+        set_temp(temperature)
+        set_hum(humidity)
+        set_volt(voltage)
+        set_uptime(uptime_seconds)
+
+    return detection_callback
 
 
 def set_location_gauge():
     """
     Load location metadata from CSV file and set the location info gauge."""
-    script_dir = os.path.dirname(os.path.realpath(__file__))
-    with open(f"{script_dir}/resources/locations.csv", encoding="utf-8") as f:
+    with LOCATIONS_CSV.open(encoding="utf-8") as f:
         reader = csv.reader(f)
         next(reader)  # skip header
-        for row in reader:
-            if len(row) == 2:
-                address, location = row
-                location_gauge.labels(
-                    address=address.strip(), location=location.strip()
-                ).set(1)
-        logging.info("Loaded location metadata from CSV")
+        locations = {row[0].strip(): row[1].strip() for row in reader if len(row) == 2}
+
+    for address, location in locations.items():
+        location_gauge.labels(address=address, location=location).set(1)
+    logger.info("Loaded location metadata from CSV")
+
+
+# === Metrics server ===
+class CachedRegistry:
+    """
+    Registry wrapper reusing collected metric families for up to ttl seconds.
+    """
+
+    def __init__(self, registry=REGISTRY, ttl: float = 0.5):
+        self.registry = registry
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._metrics = []
+        self._expires = 0.0
+
+    def collect(self):
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._expires:
+                self._metrics = list(self.registry.collect())
+                self._expires = now + self.ttl
+            return self._metrics
+
+    def restricted_registry(self, names):
+        # name[] filtered scrapes are rare, serve them uncached
+        return self.registry.restricted_registry(names)
 
 
 # === Main scan loop ===
 async def run_scan():
+    # Pattern is a name prefix match, so use the prefix common to all targets
+    name_prefix = os.path.commonprefix(list(TARGETS))
     scanner = BleakScanner(
-        detection_callback,
+        make_detection_callback(TARGETS, MANUFACTURER_ID, {}),
         scanning_mode="passive",
         bluez=BlueZScannerArgs(
-            filters=BlueZDiscoveryFilters(Pattern=TARGET_NAME),
+            filters=BlueZDiscoveryFilters(Pattern=name_prefix),
             or_patterns=[
                 OrPattern(
                     0,
@@ -131,10 +242,18 @@ async def run_scan():
         ),
     )
 
+    # Idle until SIGINT/SIGTERM instead of waking the loop periodically
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
     await scanner.start()
-    logging.info("Scanner started.")
-    while True:
-        await asyncio.sleep(1)
+    logger.info("Scanner started.")
+    try:
+        await stop.wait()
+    finally:
+        await scanner.stop()
 
 
 # === Entry point ===
@@ -145,20 +264,35 @@ async def main():
     parser.add_argument(
         "--port", type=int, default=8000, help="Prometheus metrics port"
     )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=0.5,
+        help="Seconds to reuse collected metrics between scrapes",
+    )
     args = parser.parse_args()
 
     set_location_gauge()
 
     # Start Prometheus server
-    start_http_server(args.port)
-    logging.info("Prometheus metrics server started on port %d", args.port)
+    start_http_server(args.port, registry=CachedRegistry(ttl=args.cache_ttl))
+    logger.info("Prometheus metrics server started on port %d", args.port)
 
     # Start BLE scanner
     await run_scan()
+    logger.info("Exiting.")
 
 
 if __name__ == "__main__":
+    # Prefer the libuv event loop when available
+    try:
+        import uvloop
+
+        run = uvloop.run
+    except ImportError:
+        run = asyncio.run
+
     try:
-        asyncio.run(main())
+        run(main())
     except KeyboardInterrupt:
-        logging.info("Exiting.")
+        logger.info("Exiting.")